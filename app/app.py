@@ -83,6 +83,13 @@ def create_app(config_name='development'):
     # Register routes
     from app.routes import api
     app.register_blueprint(api.bp)
+
+    # Warm the retriever now instead of on the first user request
+    try:
+        from src.rag.retriever import warm
+        warm()
+    except Exception as e:
+        logger.warning(f"⚠️  Retriever warmup failed: {e}")
     
     logger.info(f"✅ Flask app created (config: {config_name})")
     
@@ -8,11 +8,12 @@ Date: 2026-01-22
 Version: 2.1 - FIX P1: Context-Aware Retrieval
 """
 
+import json
 import logging
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 
 from src.rag.retriever import get_retriever, format_products_for_context
-from src.api.claude_client import get_claude_client
+from src.api.claude_client import StreamFailure, get_claude_client
 
 logger = logging.getLogger('api_routes')
 
@@ -27,6 +28,58 @@ def get_client_ip():
     else:
         return request.remote_addr
 
+def _prepare_chat_context(session_id, user_message):
+    """
+    Run context-aware retrieval for a chat turn (FIX P1)
+
+    Enriches short followup queries with the previous user message to
+    prevent hallucinations, then retrieves and formats products.
+
+    Returns:
+        (products, products_context, claude_history)
+    """
+    retriever = get_retriever()
+
+    # Get conversation history BEFORE current message
+    conversation_history = current_app.session_manager.get_conversation_history(session_id)
+
+    # Only exclude current message if there's actual prior history
+    if len(conversation_history) > 1:
+        conversation_history = conversation_history[:-1]
+    else:
+        conversation_history = []
+
+    # Context-aware retrieval: Enrich short queries with previous context
+    enriched_query = user_message
+
+    if len(user_message.split()) <= 5 and conversation_history:
+        last_user_msgs = [m for m in conversation_history if m['role'] == 'user']
+
+        if last_user_msgs:
+            last_user_content = last_user_msgs[-1]['content']
+            enriched_query = f"{last_user_content} {user_message}"
+            logger.info(
+                f"Enriched short query: '{user_message}' → '{enriched_query[:100]}...'"
+            )
+
+    logger.info(f"Searching products for: '{enriched_query[:100]}'")
+    products = retriever.search(
+        query=enriched_query,
+        top_k=20,
+        min_similarity=0.0
+    )
+
+    logger.info(f"Found {len(products)} relevant products")
+
+    products_context = format_products_for_context(products, max_products=20)
+
+    claude_history = [
+        {'role': msg['role'], 'content': msg['content']}
+        for msg in conversation_history
+    ]
+
+    return products, products_context, claude_history
+
 @bp.route('/session/start', methods=['POST'])
 def start_session():
     """Start new conversation session"""
@@ -60,8 +113,8 @@ def chat():
         if not session_id:
             return jsonify({'error': 'session_id required'}), 400
         
-        if not user_message:
-            return jsonify({'error': 'message required'}), 400
+        if not user_message or not isinstance(user_message, str):
+            return jsonify({'error': 'message must be a non-empty string'}), 400
         
         ip_address = get_client_ip()
         
@@ -72,13 +125,13 @@ def chat():
                 estimated_cost=0.051
             )
             
-            if not rate_check['allowed']:
+            if not rate_check.allowed:
                 logger.warning(f"Rate limit exceeded: {ip_address}")
                 return jsonify({
                     'error': 'Rate limit exceeded',
-                    'reason': rate_check['reason'],
-                    'message': rate_check.get('message', 'Too many requests'),
-                    'retry_after': rate_check.get('retry_after', 60)
+                    'reason': rate_check.reason,
+                    'message': rate_check.message or 'Too many requests',
+                    'retry_after': rate_check.retry_after or 60
                 }), 429
         
         session = current_app.session_manager.get_session(session_id)
@@ -91,66 +144,22 @@ def chat():
         
         # RAG PIPELINE + CLAUDE
         try:
-            retriever = get_retriever()
-            
-            # ========================================
-            # FIX P1: CONTEXT-AWARE QUERY ENRICHMENT
-            # ========================================
-            
-            # Get conversation history BEFORE current message
-            conversation_history = current_app.session_manager.get_conversation_history(session_id)
-            
-            # FIXED: Don't remove last message if history has only 1 item (the current message)
-            # Only exclude current message if there's actual prior history
-            if len(conversation_history) > 1:
-                # Exclude the message we just added (last one)
-                conversation_history = conversation_history[:-1]
-            else:
-                # First message in conversation - no prior history
-                conversation_history = []
-            
-            # Context-aware retrieval: Enrich short queries with previous context
-            # This prevents hallucinations on followup queries like "fammi vedere cosa hai"
-            enriched_query = user_message  # Default: use message as-is
-            
-            if len(user_message.split()) <= 5 and conversation_history:
-                # Short query + we have context → combine with last user message
-                last_user_msgs = [m for m in conversation_history if m['role'] == 'user']
-                
-                if last_user_msgs:
-                    last_user_content = last_user_msgs[-1]['content']
-                    enriched_query = f"{last_user_content} {user_message}"
-                    logger.info(
-                        f"Enriched short query: '{user_message}' → '{enriched_query[:100]}...'"
-                    )
-            
-            # Use enriched query for retrieval
-            logger.info(f"Searching products for: '{enriched_query[:100]}'")
-            products = retriever.search(
-                query=enriched_query,  # ← FIXED: Use enriched_query instead of user_message
-                top_k=20,
-                min_similarity=0.0
+            products, products_context, claude_history = _prepare_chat_context(
+                session_id, user_message
             )
-            
-            logger.info(f"Found {len(products)} relevant products")
-            
-            products_context = format_products_for_context(products, max_products=20)
-            
-            # Prepare history for Claude (already filtered above)
-            claude_history = [
-                {'role': msg['role'], 'content': msg['content']}
-                for msg in conversation_history
-            ]
-            
+
             logger.info(f"Formatted {len(claude_history)} messages for Claude")
             
             claude_client = get_claude_client()
             
             logger.info("Calling Claude API...")
+            # History comes straight from the session store, which only
+            # holds messages validated on earlier turns
             ai_response, claude_metadata = claude_client.get_response(
                 user_message=user_message,
                 conversation_history=claude_history,
-                products_context=products_context
+                products_context=products_context,
+                history_is_trusted=True
             )
             
             if not claude_metadata.get('success', False):
@@ -205,6 +214,99 @@ def chat():
         logger.error(f"Error processing chat: {e}", exc_info=True)
         return jsonify({'error': 'Failed to process message'}), 500
 
+@bp.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Send message and stream the AI response incrementally (SSE)"""
+    try:
+        data = request.get_json()
+
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        session_id = data.get('session_id')
+        user_message = data.get('message')
+
+        if not session_id:
+            return jsonify({'error': 'session_id required'}), 400
+
+        if not user_message or not isinstance(user_message, str):
+            return jsonify({'error': 'message must be a non-empty string'}), 400
+
+        ip_address = get_client_ip()
+
+        if current_app.rate_limiter:
+            rate_check = current_app.rate_limiter.check_request(
+                ip_address,
+                session_id,
+                estimated_cost=0.051
+            )
+
+            if not rate_check.allowed:
+                logger.warning(f"Rate limit exceeded: {ip_address}")
+                return jsonify({
+                    'error': 'Rate limit exceeded',
+                    'reason': rate_check.reason,
+                    'message': rate_check.message or 'Too many requests',
+                    'retry_after': rate_check.retry_after or 60
+                }), 429
+
+        session = current_app.session_manager.get_session(session_id)
+
+        if not session:
+            logger.warning(f"Invalid session: {session_id[:8]}...")
+            return jsonify({'error': 'Invalid or expired session'}), 401
+
+        current_app.session_manager.add_message(session_id, 'user', user_message)
+
+        products, products_context, claude_history = _prepare_chat_context(
+            session_id, user_message
+        )
+
+        claude_client = get_claude_client()
+
+        def generate():
+            chunks = []
+            failed = False
+
+            for chunk in claude_client.stream_response(
+                user_message=user_message,
+                conversation_history=claude_history,
+                products_context=products_context,
+                history_is_trusted=True
+            ):
+                if isinstance(chunk, StreamFailure):
+                    # Distinct event so clients can tell the apology
+                    # text from real model output
+                    failed = True
+                    yield f"data: {json.dumps({'error': str(chunk)})}\n\n"
+                    break
+                chunks.append(chunk)
+                yield f"data: {json.dumps({'delta': chunk})}\n\n"
+
+            ai_response = ''.join(chunks)
+            if ai_response:
+                current_app.session_manager.add_message(session_id, 'assistant', ai_response)
+
+            # Mirror the non-stream path: failed requests are not
+            # charged against the user's rate/cost budget
+            if current_app.rate_limiter and not failed:
+                current_app.rate_limiter.record_request(ip_address, session_id, 0.051)
+
+            if failed:
+                logger.warning(f"Chat stream failed: {session_id[:8]}...")
+            else:
+                logger.info(f"Chat stream complete: {session_id[:8]}...")
+            yield f"data: {json.dumps({'done': True, 'success': not failed, 'products_retrieved': len(products)})}\n\n"
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream'
+        )
+
+    except Exception as e:
+        logger.error(f"Error processing chat stream: {e}", exc_info=True)
+        return jsonify({'error': 'Failed to process message'}), 500
+
 @bp.route('/session/<session_id>/history', methods=['GET'])
 def get_history(session_id):
     """Get conversation history for session"""
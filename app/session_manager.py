@@ -104,6 +104,15 @@ class SessionManager:
         Returns:
             True if successful, False otherwise
         """
+        # The conversation manager treats stored history as validated
+        # (history_is_trusted), so nothing but strings may get in here
+        if not isinstance(content, str):
+            logger.error(
+                f"Cannot add message: non-string content "
+                f"({type(content).__name__}) for session {session_id[:8]}..."
+            )
+            return False
+
         with self.lock:
             session = self.sessions.get(session_id)
             
@@ -28,6 +28,13 @@ from sentence_transformers import SentenceTransformer
 # Vector database
 import faiss
 
+# Optional columnar metadata sidecar (the retriever prefers it when present)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
 # Import configuration
 sys.path.append(str(Path(__file__).parent.parent.parent))
 from scripts.embeddings.embedding_config import (
@@ -256,11 +263,17 @@ class FAISSManager:
         logger.info("💾 Initializing FAISS index...")
         
         try:
-            # Create IndexFlatIP (Inner Product for normalized vectors = cosine similarity)
-            self.index = faiss.IndexFlatIP(self.dimension)
-            
+            # fp16 scalar quantizer with inner product (normalized
+            # vectors = cosine similarity): half the RAM and memory
+            # bandwidth of flat fp32 during the distance sweep, with
+            # recall essentially identical to flat. fp32 queries are
+            # accepted transparently at search time.
+            self.index = faiss.index_factory(
+                self.dimension, "SQfp16", faiss.METRIC_INNER_PRODUCT
+            )
+
             logger.info(f"✅ FAISS index initialized:")
-            logger.info(f"   • Index type: IndexFlatIP (cosine similarity)")
+            logger.info(f"   • Index type: SQfp16 (cosine similarity)")
             logger.info(f"   • Dimensions: {self.dimension}")
             logger.info(f"   • Initial count: {self.index.ntotal}")
             
@@ -275,7 +288,12 @@ class FAISSManager:
         try:
             # Ensure embeddings are float32 (FAISS requirement)
             embeddings = embeddings.astype('float32')
-            
+
+            # Scalar quantizers need a train call before the first add
+            # (for fp16 it's trivial but the API requires it)
+            if not self.index.is_trained:
+                self.index.train(embeddings)
+
             # Add to FAISS index
             self.index.add(embeddings)
             
@@ -301,7 +319,15 @@ class FAISSManager:
             with open(FAISS_CONFIG['metadata_file'], 'w', encoding='utf-8') as f:
                 json.dump(self.metadata, f, indent=2, ensure_ascii=False)
             logger.info(f"✅ Metadata saved to {FAISS_CONFIG['metadata_file']}")
-            
+
+            # Save columnar sidecar (loads faster and ~3-5x smaller in RAM)
+            if pa is not None:
+                parquet_file = str(
+                    Path(FAISS_CONFIG['metadata_file']).with_suffix('.parquet')
+                )
+                pq.write_table(pa.Table.from_pylist(self.metadata), parquet_file)
+                logger.info(f"✅ Metadata parquet saved to {parquet_file}")
+
         except Exception as e:
             logger.error(f"❌ Error saving FAISS index/metadata: {e}")
             raise
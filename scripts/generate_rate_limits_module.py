@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Rate Limits Module Generator for Glamhair Multi Comparator
+Compiles config/rate_limits.yaml into an importable Python module
+
+The rate limiter prefers the generated module over parsing YAML/JSON:
+the import system loads the cached .pyc, so config costs nothing on
+warm starts. Run this as a build step whenever rate_limits.yaml changes.
+
+Author: Peppe
+Date: 2026-08-26
+"""
+
+import pprint
+from pathlib import Path
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+CONFIG_DIR = Path(__file__).parent.parent / 'config'
+
+def main():
+    yaml_file = CONFIG_DIR / 'rate_limits.yaml'
+    py_file = CONFIG_DIR / 'rate_limits.py'
+
+    with open(yaml_file, 'r') as f:
+        limits = yaml.load(f, Loader=_YamlLoader)
+
+    body = pprint.pformat(limits, width=79, sort_dicts=False)
+    # Write via temp file + rename so a reader never sees a
+    # half-written module
+    tmp_file = py_file.with_suffix('.py.tmp')
+    tmp_file.write_text(
+        '"""Generated from rate_limits.yaml - do not edit by hand.\n\n'
+        'Regenerate with: python scripts/generate_rate_limits_module.py\n'
+        '"""\n\n'
+        f'LIMITS = {body}\n',
+        encoding='utf-8'
+    )
+    tmp_file.replace(py_file)
+    print(f"✅ Wrote {py_file}")
+
+if __name__ == '__main__':
+    main()
@@ -90,7 +90,7 @@ class RateLimiterTestSuite:
         limiter = self._create_limiter()
         result = limiter.check_request("10.0.0.1", "test_session_1", 0.051)
         
-        if result['allowed'] and not result.get('throttled'):
+        if result.allowed and not result.throttled:
             limiter.record_request("10.0.0.1", "test_session_1", 0.051)
             print_success("Normal request allowed and recorded")
             self.passed += 1
@@ -113,7 +113,7 @@ class RateLimiterTestSuite:
         allowed_count = 0
         for i in range(10):
             result = limiter.check_request(ip, session, 0.051)
-            if result['allowed']:
+            if result.allowed:
                 limiter.record_request(ip, session, 0.051)
                 allowed_count += 1
         
@@ -127,9 +127,9 @@ class RateLimiterTestSuite:
         # 11th request should be blocked
         result = limiter.check_request(ip, session, 0.051)
         
-        if not result['allowed'] and result['reason'] == 'rate_limit_minute':
-            print_success(f"11th request correctly blocked: {result['reason']}")
-            print_info(f"Retry after: {result['retry_after']} seconds")
+        if not result.allowed and result.reason == 'rate_limit_minute':
+            print_success(f"11th request correctly blocked: {result.reason}")
+            print_info(f"Retry after: {result.retry_after} seconds")
             self.passed += 1
         else:
             print_error(f"11th request should be blocked, got: {result}")
@@ -162,7 +162,7 @@ class RateLimiterTestSuite:
         sent_count = 0
         for i in range(20):
             result = limiter.check_request(ip, session, 0.051)
-            if result['allowed']:
+            if result.allowed:
                 limiter.record_request(ip, session, 0.051)
                 sent_count += 1
             else:
@@ -174,7 +174,7 @@ class RateLimiterTestSuite:
         if sent_count == 20:
             result = limiter.check_request(ip, session, 0.051)
             
-            if not result['allowed'] and result['reason'] == 'session_message_limit':
+            if not result.allowed and result.reason == 'session_message_limit':
                 print_success(f"Session limit correctly enforced after {sent_count} messages")
                 self.passed += 1
             else:
@@ -195,7 +195,7 @@ class RateLimiterTestSuite:
         # Test with whitelisted IP (127.0.0.1)
         result = limiter.check_request("127.0.0.1", "any_session", 0.051)
         
-        if result.get('allowed') and result.get('whitelisted'):
+        if result.allowed and result.whitelisted:
             print_success("Whitelisted IP correctly bypasses limits")
             self.passed += 1
         else:
@@ -279,7 +279,7 @@ def test_edge_cases():
     # Test 1: Empty session ID
     print_test("Edge Case 1: Empty session ID")
     result = limiter.check_request("10.0.0.100", "", 0.051)
-    if result['allowed']:
+    if result.allowed:
         print_success("Handles empty session ID")
     else:
         print_warning(f"Empty session ID blocked: {result}")
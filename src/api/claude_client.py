@@ -7,44 +7,312 @@ Author: Peppe
 Date: 2026-01-21
 """
 
+import asyncio
+import atexit
+import hashlib
+import json
 import logging
+import queue
+import random
+import threading
 import time
-from typing import List, Dict, Tuple
+from collections import OrderedDict
+from typing import AsyncIterator, List, Dict, Iterator, Optional, Tuple
 import anthropic
+import httpx
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from src.config import (
     ANTHROPIC_API_KEY,
     MODEL_NAME,
     MODEL_TEMPERATURE,
     MAX_TOKENS,
+    MAX_CONCURRENT_CALLS,
 )
 
-from src.api.prompts.base_prompt import get_system_prompt
+from src.api.prompts.base_prompt import get_system_prompt_blob
 from src.api.prompts.conversation_manager import ConversationManager
 
 logger = logging.getLogger(__name__)
 
+# ============================================
+# SHARED EVENT LOOP
+# ============================================
+# One background event loop shared by all Flask workers so concurrent
+# Claude calls overlap on network I/O instead of serializing per thread.
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """Get or start the shared background event loop"""
+    global _loop
+
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever,
+                    name='claude-event-loop',
+                    daemon=True
+                )
+                thread.start()
+                _loop = loop
+
+    return _loop
+
+class StreamFailure(str):
+    """
+    Error text yielded by stream_response when the stream fails.
+
+    A str subclass, so consumers that only concatenate text keep
+    working, while callers that care (SSE routes, cost recording) can
+    isinstance-check to distinguish the apology from model output.
+    """
+
+# ============================================
+# RESPONSE CACHE
+# ============================================
+
+# Retry policy for transient API failures (429s, connection drops)
+MAX_RETRY_ATTEMPTS = 6
+RETRY_BASE_DELAY = 10.0
+RETRY_MAX_DELAY = 60.0
+
+RESPONSE_CACHE_MAXSIZE = 10_000
+RESPONSE_CACHE_TTL = 3600.0
+SEMANTIC_CACHE_MAXSIZE = 5_000
+SEMANTIC_CACHE_THRESHOLD = 0.97
+
+class _ResponseCache:
+    """
+    Two-tier cache for Claude responses:
+    1. Exact tier: TTL dict keyed on (system prompt, messages, model params)
+    2. Semantic tier: FAISS inner-product index over recent user queries,
+       reusing the RAG embedding model (hit when cosine >= threshold and
+       the products context is unchanged)
+    """
+
+    def __init__(
+        self,
+        maxsize: int = RESPONSE_CACHE_MAXSIZE,
+        ttl: float = RESPONSE_CACHE_TTL
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._exact = OrderedDict()  # key -> (expires_at, response_text, metadata)
+        self._lock = threading.Lock()
+
+        # Semantic tier (built lazily; disabled if the retriever is
+        # unavailable). Lookups and stores run on executor threads, so
+        # the index and its parallel entry list get their own lock.
+        self._sem_lock = threading.Lock()
+        self._sem_index = None
+        self._sem_entries = []  # parallel to index rows: (expires_at, context_key, text, metadata)
+        self._sem_disabled = False
+
+    @staticmethod
+    def make_key(
+        system_utf8: bytes,
+        messages: List[Dict],
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> str:
+        """Build exact cache key from the full request payload"""
+        # orjson emits bytes directly and skips json.dumps' pure-Python
+        # encoder; stdlib json remains as fallback. The system prompt
+        # arrives pre-encoded (PromptBlob.utf8), so nothing is re-encoded.
+        fields = [model, temperature, max_tokens, messages]
+        if orjson is not None:
+            payload = orjson.dumps(fields, option=orjson.OPT_SORT_KEYS)
+        else:
+            payload = json.dumps(
+                fields, separators=(',', ':'), sort_keys=True
+            ).encode('utf-8')
+
+        h = hashlib.blake2b(digest_size=16)
+        h.update(system_utf8)
+        h.update(b'\0')
+        h.update(payload)
+        return h.hexdigest()
+
+    def _encoder(self):
+        """Get the shared RAG embedding model (None if unavailable)"""
+        if self._sem_disabled:
+            return None
+
+        try:
+            from src.rag.retriever import get_retriever
+            return get_retriever().model
+        except Exception as e:
+            logger.warning("Semantic cache disabled (retriever unavailable): %s", e)
+            self._sem_disabled = True
+            return None
+
+    def get_exact(self, key: str) -> Optional[Tuple[str, Dict]]:
+        """Look up an exact-key cache entry"""
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is None:
+                return None
+
+            expires_at, response_text, metadata = entry
+            if time.time() > expires_at:
+                del self._exact[key]
+                return None
+
+            self._exact.move_to_end(key)
+            return response_text, metadata
+
+    def get_semantic(self, user_message: str, context_key: str) -> Optional[Tuple[str, Dict]]:
+        """Look up a semantically similar cached query"""
+        model = self._encoder()
+        if model is None or self._sem_index is None or not self._sem_entries:
+            return None
+
+        try:
+            import numpy as np
+
+            embedding = model.encode(
+                user_message,
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            ).reshape(1, -1).astype('float32')
+
+            with self._sem_lock:
+                if self._sem_index is None or not self._sem_entries:
+                    return None
+
+                similarities, indices = self._sem_index.search(embedding, 1)
+
+                if indices[0][0] == -1 or similarities[0][0] < SEMANTIC_CACHE_THRESHOLD:
+                    return None
+
+                expires_at, entry_context, response_text, metadata = \
+                    self._sem_entries[indices[0][0]]
+
+            # Only reuse when the products context is unchanged
+            if time.time() > expires_at or entry_context != context_key:
+                return None
+
+            return response_text, metadata
+
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed: %s", e)
+            return None
+
+    def put(
+        self,
+        key: str,
+        user_message: str,
+        context_key: str,
+        response_text: str,
+        metadata: Dict
+    ):
+        """Store a fresh response in both tiers"""
+        expires_at = time.time() + self.ttl
+
+        with self._lock:
+            self._exact[key] = (expires_at, response_text, metadata)
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.maxsize:
+                self._exact.popitem(last=False)
+
+        model = self._encoder()
+        if model is None:
+            return
+
+        try:
+            import faiss
+
+            embedding = model.encode(
+                user_message,
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            ).reshape(1, -1).astype('float32')
+
+            with self._sem_lock:
+                if self._sem_index is None:
+                    self._sem_index = faiss.IndexFlatIP(embedding.shape[1])
+
+                if self._sem_index.ntotal >= SEMANTIC_CACHE_MAXSIZE:
+                    self._sem_index.reset()
+                    self._sem_entries = []
+
+                self._sem_index.add(embedding)
+                self._sem_entries.append(
+                    (expires_at, context_key, response_text, metadata)
+                )
+
+        except Exception as e:
+            logger.warning("Semantic cache store failed: %s", e)
+
+class _Stats:
+    """Hot per-call counters as plain attributes (no dict hashing)"""
+
+    __slots__ = (
+        'total_calls',
+        'successful_calls',
+        'failed_calls',
+        'cache_hits',
+        'total_input_tokens',
+        'total_output_tokens',
+        'total_cost_usd',
+    )
+
+    def __init__(self):
+        self.total_calls = 0
+        self.successful_calls = 0
+        self.failed_calls = 0
+        self.cache_hits = 0
+        self.total_input_tokens = 0
+        self.total_output_tokens = 0
+        self.total_cost_usd = 0.0
+
+    def as_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
 class ClaudeClient:
     """Client for Anthropic Claude API"""
-    
+
     def __init__(self):
         if not ANTHROPIC_API_KEY:
             raise ValueError("ANTHROPIC_API_KEY not found")
-        
-        self.client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+
+        # Pooled keep-alive HTTP client so repeated API calls reuse TLS
+        # connections instead of paying a new handshake per request
+        # (notably when Gunicorn forks workers)
+        limits = httpx.Limits(
+            max_keepalive_connections=32,
+            max_connections=64,
+            keepalive_expiry=60.0
+        )
+        self._http = httpx.AsyncClient(
+            limits=limits,
+            timeout=httpx.Timeout(60.0, connect=5.0)
+        )
+
+        self.client = anthropic.AsyncAnthropic(
+            api_key=ANTHROPIC_API_KEY,
+            http_client=self._http
+        )
         self.conversation_manager = ConversationManager()
-        
-        self.stats = {
-            'total_calls': 0,
-            'successful_calls': 0,
-            'failed_calls': 0,
-            'total_input_tokens': 0,
-            'total_output_tokens': 0,
-            'total_cost_usd': 0.0,
-        }
-        
-        logger.info(f"ClaudeClient initialized with model: {MODEL_NAME}")
-    
+
+        # Bounds the number of in-flight API calls on the shared loop
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_CALLS)
+
+        self._cache = _ResponseCache()
+        self._stats = _Stats()
+        self._seen_errors: Dict[type, int] = {}
+
+        logger.info("ClaudeClient initialized with model: %s", MODEL_NAME)
+
     def get_response(
         self,
         user_message: str,
@@ -52,47 +320,110 @@ class ClaudeClient:
         products_context: str = None,
         max_tokens: int = None,
         temperature: float = None,
+        history_is_trusted: bool = False,
+    ) -> Tuple[str, Dict]:
+        """Get response from Claude (sync wrapper over the shared event loop)"""
+        future = asyncio.run_coroutine_threadsafe(
+            self.aget_response(
+                user_message=user_message,
+                conversation_history=conversation_history,
+                products_context=products_context,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                history_is_trusted=history_is_trusted,
+            ),
+            _get_event_loop()
+        )
+        return future.result()
+
+    async def aget_response(
+        self,
+        user_message: str,
+        conversation_history: List[Dict] = None,
+        products_context: str = None,
+        max_tokens: int = None,
+        temperature: float = None,
+        history_is_trusted: bool = False,
     ) -> Tuple[str, Dict]:
         """Get response from Claude"""
         if max_tokens is None:
             max_tokens = MAX_TOKENS
-        
+
         if temperature is None:
             temperature = MODEL_TEMPERATURE
-        
+
         try:
-            logger.info(f"Getting Claude response for: '{user_message[:100]}...'")
+            logger.info("Getting Claude response for: %r", user_message[:100])
             start_time = time.time()
-            
-            system_prompt = get_system_prompt(products_context=products_context)
-            
-            messages = self.conversation_manager.format_for_claude(
+
+            # Prompt build + truncation + formatting happens exactly once
+            # per user turn; retries below only repeat the network call
+            payload = self._build_payload(
+                user_message=user_message,
                 conversation_history=conversation_history,
-                new_user_message=user_message
-            )
-            
-            response = self.client.messages.create(
-                model=MODEL_NAME,
+                products_context=products_context,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                system=system_prompt,
-                messages=messages
+                history_is_trusted=history_is_trusted,
             )
-            
+            messages = payload['messages']
+
+            # Cache lookup: exact key first, then semantic similarity.
+            # The blob carries pre-encoded bytes + digest (lru-cached), so
+            # no multi-KB str encode happens here.
+            blob = get_system_prompt_blob(products_context=products_context)
+            cache_key = _ResponseCache.make_key(
+                blob.utf8, messages, MODEL_NAME, temperature, max_tokens
+            )
+            context_key = blob.sha16.hex()
+
+            cached = self._cache.get_exact(cache_key)
+            cache_tier = 'exact'
+
+            if cached is None:
+                # The semantic tier runs a transformer forward pass;
+                # keep it off the shared event loop so it can't stall
+                # every other in-flight call and stream
+                loop = asyncio.get_running_loop()
+                cached = await loop.run_in_executor(
+                    None, self._cache.get_semantic, user_message, context_key
+                )
+                cache_tier = 'semantic'
+
+            if cached is not None:
+                response_text, cached_metadata = cached
+
+                s = self._stats
+                s.total_calls += 1
+                s.successful_calls += 1
+                s.cache_hits += 1
+
+                metadata = dict(cached_metadata)
+                metadata['cost_usd'] = 0.0
+                metadata['cached'] = True
+                metadata['cache_tier'] = cache_tier
+                metadata['elapsed_time'] = time.time() - start_time
+
+                logger.info("✅ Response cache hit (%s)", cache_tier)
+                return response_text, metadata
+
+            response = await self._create_with_retry(payload)
+
             response_text = response.content[0].text
-            
+
             elapsed_time = time.time() - start_time
             input_tokens = response.usage.input_tokens
             output_tokens = response.usage.output_tokens
-            
+
             cost_usd = self._calculate_cost(input_tokens, output_tokens)
-            
-            self.stats['total_calls'] += 1
-            self.stats['successful_calls'] += 1
-            self.stats['total_input_tokens'] += input_tokens
-            self.stats['total_output_tokens'] += output_tokens
-            self.stats['total_cost_usd'] += cost_usd
-            
+
+            s = self._stats
+            s.total_calls += 1
+            s.successful_calls += 1
+            s.total_input_tokens += input_tokens
+            s.total_output_tokens += output_tokens
+            s.total_cost_usd += cost_usd
+
             metadata = {
                 'success': True,
                 'model': MODEL_NAME,
@@ -103,47 +434,203 @@ class ClaudeClient:
                 'elapsed_time': elapsed_time,
                 'stop_reason': response.stop_reason,
             }
-            
+
             logger.info(
                 f"✅ Claude response received "
                 f"({input_tokens} in / {output_tokens} out / "
                 f"${cost_usd:.4f} / {elapsed_time:.2f}s)"
             )
-            
+
+            # Store off-loop for the same reason as the semantic
+            # lookup; fire-and-forget, put() handles its own failures
+            asyncio.get_running_loop().run_in_executor(
+                None, self._cache.put,
+                cache_key, user_message, context_key, response_text, metadata
+            )
+
             return response_text, metadata
-            
+
         except anthropic.APIError as e:
-            logger.error(f"Anthropic API error: {e}")
-            self.stats['total_calls'] += 1
-            self.stats['failed_calls'] += 1
-            
+            logger.error("Anthropic API error: %s", e)
+            self._record_failure()
+
             metadata = {
                 'success': False,
                 'error_type': 'api_error',
                 'error_message': str(e),
             }
-            
+
             return self._get_error_response(e), metadata
-            
+
         except Exception as e:
-            logger.error(f"Unexpected error: {e}", exc_info=True)
-            self.stats['total_calls'] += 1
-            self.stats['failed_calls'] += 1
-            
+            # Capture a full traceback only on the first occurrence of
+            # each error type; repeats during an incident log without it
+            seen = self._seen_errors.get(type(e), 0)
+            self._seen_errors[type(e)] = seen + 1
+            logger.error("Unexpected error: %s", e, exc_info=(seen == 0))
+            self._record_failure()
+
             metadata = {
                 'success': False,
                 'error_type': 'unknown_error',
                 'error_message': str(e),
             }
-            
+
             return self._get_error_response(e), metadata
-    
+
+    def _record_failure(self):
+        """Update counters for a failed call"""
+        self._stats.total_calls += 1
+        self._stats.failed_calls += 1
+
+    async def astream_response(
+        self,
+        user_message: str,
+        conversation_history: List[Dict] = None,
+        products_context: str = None,
+        max_tokens: int = None,
+        temperature: float = None,
+        history_is_trusted: bool = False,
+    ) -> AsyncIterator[str]:
+        """Stream response text from Claude as it is generated"""
+        if max_tokens is None:
+            max_tokens = MAX_TOKENS
+
+        if temperature is None:
+            temperature = MODEL_TEMPERATURE
+
+        payload = self._build_payload(
+            user_message=user_message,
+            conversation_history=conversation_history,
+            products_context=products_context,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            history_is_trusted=history_is_trusted,
+        )
+
+        async with self._semaphore:
+            async with self.client.messages.stream(**payload) as stream:
+                async for text in stream.text_stream:
+                    yield text
+
+                final = await stream.get_final_message()
+
+        input_tokens = final.usage.input_tokens
+        output_tokens = final.usage.output_tokens
+        cost_usd = self._calculate_cost(input_tokens, output_tokens)
+
+        s = self._stats
+        s.total_calls += 1
+        s.successful_calls += 1
+        s.total_input_tokens += input_tokens
+        s.total_output_tokens += output_tokens
+        s.total_cost_usd += cost_usd
+
+        logger.info(
+            f"✅ Claude stream complete "
+            f"({input_tokens} in / {output_tokens} out / ${cost_usd:.4f})"
+        )
+
+    def stream_response(
+        self,
+        user_message: str,
+        conversation_history: List[Dict] = None,
+        products_context: str = None,
+        max_tokens: int = None,
+        temperature: float = None,
+        history_is_trusted: bool = False,
+    ) -> Iterator[str]:
+        """
+        Stream response text (sync bridge over the shared event loop)
+
+        On failure the final item is a StreamFailure carrying the
+        user-facing error text, so callers can tell an apology from
+        real model output.
+        """
+        chunks: queue.Queue = queue.Queue()
+        done = object()
+
+        async def _pump():
+            try:
+                async for text in self.astream_response(
+                    user_message=user_message,
+                    conversation_history=conversation_history,
+                    products_context=products_context,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    history_is_trusted=history_is_trusted,
+                ):
+                    chunks.put(text)
+            except Exception as e:
+                logger.error("Error streaming Claude response: %s", e)
+                self._stats.total_calls += 1
+                self._stats.failed_calls += 1
+                chunks.put(e)
+            finally:
+                chunks.put(done)
+
+        asyncio.run_coroutine_threadsafe(_pump(), _get_event_loop())
+
+        while True:
+            item = chunks.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                yield StreamFailure(self._get_error_response(item))
+                break
+            yield item
+
+    def _build_payload(
+        self,
+        user_message: str,
+        conversation_history: List[Dict],
+        products_context: str,
+        max_tokens: int,
+        temperature: float,
+        history_is_trusted: bool = False,
+    ) -> Dict:
+        """Build the full messages.create payload once per user turn"""
+        system_prompt = get_system_prompt_blob(products_context=products_context).text
+
+        messages = self.conversation_manager.format_for_claude(
+            conversation_history=conversation_history,
+            new_user_message=user_message,
+            history_is_trusted=history_is_trusted
+        )
+
+        return {
+            'model': MODEL_NAME,
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+            'system': system_prompt,
+            'messages': messages,
+        }
+
+    async def _create_with_retry(self, payload: Dict):
+        """Call messages.create, retrying transient failures with backoff"""
+        for attempt in range(MAX_RETRY_ATTEMPTS):
+            try:
+                async with self._semaphore:
+                    return await self.client.messages.create(**payload)
+
+            except (anthropic.RateLimitError, anthropic.APIConnectionError) as e:
+                if attempt == MAX_RETRY_ATTEMPTS - 1:
+                    raise
+
+                delay = min(RETRY_BASE_DELAY * (2 ** attempt), RETRY_MAX_DELAY)
+                delay += random.uniform(0, 1)
+                logger.warning(
+                    f"Transient API error (attempt {attempt + 1}/"
+                    f"{MAX_RETRY_ATTEMPTS}), retrying in {delay:.1f}s: {e}"
+                )
+                await asyncio.sleep(delay)
+
     def _calculate_cost(self, input_tokens: int, output_tokens: int) -> float:
         """Calculate cost (Claude Sonnet 4: $3/1M input, $15/1M output)"""
         input_cost = (input_tokens / 1_000_000) * 3.00
         output_cost = (output_tokens / 1_000_000) * 15.00
         return input_cost + output_cost
-    
+
     def _get_error_response(self, error: Exception) -> str:
         """Get user-friendly error message"""
         if isinstance(error, anthropic.RateLimitError):
@@ -166,11 +653,21 @@ class ClaudeClient:
                 "Si è verificato un errore imprevisto. "
                 "Riprova o contatta l'assistenza."
             )
-    
+
+    def close(self):
+        """Close the underlying HTTP connection pool"""
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self._http.aclose(),
+                _get_event_loop()
+            ).result(timeout=5.0)
+        except Exception as e:
+            logger.warning("Error closing HTTP client: %s", e)
+
     def get_stats(self) -> Dict:
         """Get client statistics"""
-        stats = self.stats.copy()
-        
+        stats = self._stats.as_dict()
+
         if stats['total_calls'] > 0:
             stats['success_rate'] = stats['successful_calls'] / stats['total_calls']
             stats['avg_input_tokens'] = stats['total_input_tokens'] / stats['total_calls']
@@ -181,17 +678,32 @@ class ClaudeClient:
             stats['avg_input_tokens'] = 0
             stats['avg_output_tokens'] = 0
             stats['avg_cost_per_call'] = 0.0
-        
+
         return stats
 
 _client_instance = None
+_client_lock = threading.Lock()
 
 def get_claude_client() -> ClaudeClient:
-    """Get or create global Claude client instance"""
+    """Get or create global Claude client instance (thread-safe)"""
     global _client_instance
-    
-    if _client_instance is None:
-        logger.info("Creating Claude client instance...")
-        _client_instance = ClaudeClient()
-    
-    return _client_instance
+
+    # Double-checked locking: the fast path is a single read, the lock
+    # only guards first construction so concurrent first requests can't
+    # race and build two clients (and two connection pools)
+    client = _client_instance
+    if client is not None:
+        return client
+
+    with _client_lock:
+        if _client_instance is None:
+            logger.info("Creating Claude client instance...")
+            _client_instance = ClaudeClient()
+
+        return _client_instance
+
+@atexit.register
+def _close_client():
+    """Close the global client's connection pool on shutdown"""
+    if _client_instance is not None:
+        _client_instance.close()
@@ -7,6 +7,10 @@ Author: Peppe + Claude
 Date: 2026-01-22
 """
 
+import functools
+import hashlib
+from typing import NamedTuple
+
 SYSTEM_PROMPT_TEMPLATE = """Sei il Master Hair Consultant di Glamhairshop.it, e-commerce italiano specializzato in prodotti professionali per capelli.
 
 # PRODOTTI DISPONIBILI
@@ -207,9 +211,31 @@ Che tipo di risultato cercavi con [prodotto]? Ti trovo alternative professionali
 **Il tuo obiettivo:** Aiutare genuinamente con trasparenza, non solo vendere.
 """
 
-def get_system_prompt(products_context: str = None) -> str:
-    """Build system prompt with products context"""
+# Split once at import so building a prompt is a plain concatenation
+# instead of re-parsing the ~4 KB template with str.format every call
+_TEMPLATE_HEAD, _TEMPLATE_TAIL = SYSTEM_PROMPT_TEMPLATE.split("{products_context}", 1)
+
+class PromptBlob(NamedTuple):
+    """Rendered system prompt with its UTF-8 bytes and digest precomputed"""
+    text: str
+    utf8: bytes
+    sha16: bytes
+
+@functools.lru_cache(maxsize=128)
+def _build(products_context: str) -> PromptBlob:
+    """Build and memoize the full prompt blob for a given products context"""
+    text = _TEMPLATE_HEAD + products_context + _TEMPLATE_TAIL
+    utf8 = text.encode('utf-8')
+    sha16 = hashlib.blake2b(utf8, digest_size=16).digest()
+    return PromptBlob(text, utf8, sha16)
+
+def get_system_prompt_blob(products_context: str = None) -> PromptBlob:
+    """Build system prompt blob (text + encoded bytes + digest)"""
     if not products_context:
         products_context = "Nessun prodotto disponibile nel contesto attuale."
-    
-    return SYSTEM_PROMPT_TEMPLATE.format(products_context=products_context)
+
+    return _build(products_context)
+
+def get_system_prompt(products_context: str = None) -> str:
+    """Build system prompt with products context"""
+    return get_system_prompt_blob(products_context).text
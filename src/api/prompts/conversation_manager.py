@@ -10,10 +10,50 @@ Date: 2026-01-21
 import logging
 from typing import List, Dict
 
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 logger = logging.getLogger(__name__)
 
+class _Msg:
+    """Internal message record with its char length precomputed once"""
+
+    __slots__ = ('role', 'content', 'nchars')
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+        self.nchars = len(content)
+
+def _truncate_index(lens: np.ndarray, max_chars: int) -> int:
+    """
+    Walk char lengths from the newest message backwards, accumulating
+    until the budget is exceeded; return the first index to keep.
+
+    Pure-numeric kernel: strings never cross this boundary, so numba can
+    compile it to native code when available.
+    """
+    total = 0
+    i = lens.shape[0]
+    while i > 0:
+        candidate = total + lens[i - 1]
+        if candidate > max_chars:
+            break
+        total = candidate
+        i -= 1
+    return i
+
+if njit is not None:
+    # cache=True persists the compiled kernel so workers don't recompile
+    _truncate_index = njit(cache=True)(_truncate_index)
+
 ROLE_USER = 'user'
 ROLE_ASSISTANT = 'assistant'
+_VALID_ROLES = frozenset((ROLE_USER, ROLE_ASSISTANT))
 
 MAX_CONVERSATION_TOKENS = 150_000
 CHARS_PER_TOKEN = 4
@@ -23,101 +63,127 @@ class ConversationManager:
     
     def __init__(self, max_tokens: int = MAX_CONVERSATION_TOKENS):
         self.max_tokens = max_tokens
-        logger.info(f"ConversationManager initialized (max_tokens={max_tokens})")
+        logger.info("ConversationManager initialized (max_tokens=%d)", max_tokens)
     
     def format_for_claude(
         self,
         conversation_history: List[Dict] = None,
-        new_user_message: str = None
+        new_user_message: str = None,
+        history_is_trusted: bool = False
     ) -> List[Dict]:
-        """Format conversation history for Claude API"""
-        messages = []
-        
+        """
+        Format conversation history for Claude API
+
+        Args:
+            history_is_trusted: Skip per-message validation when the
+                caller owns the history (e.g. the session store, which
+                only ever appends messages it validated on a prior turn)
+        """
+        # Internal _Msg records carry their char length, computed once at
+        # append time, so truncation never re-walks message contents.
+        # The list is preallocated to its known final size and filled by
+        # index — no amortized growth reallocations.
+        history_len = len(conversation_history) if conversation_history else 0
+        messages = [None] * (history_len + (1 if new_user_message else 0))
+        count = 0
+
         if conversation_history:
-            for msg in conversation_history:
-                if self._validate_message(msg):
-                    messages.append({
-                        'role': msg['role'],
-                        'content': msg['content']
-                    })
-        
+            if history_is_trusted:
+                for msg in conversation_history:
+                    messages[count] = _Msg(msg['role'], msg['content'])
+                    count += 1
+            else:
+                for msg in conversation_history:
+                    if self._validate_message(msg):
+                        messages[count] = _Msg(msg['role'], msg['content'])
+                        count += 1
+
         if new_user_message:
-            messages.append({
-                'role': ROLE_USER,
-                'content': new_user_message
-            })
-        
+            messages[count] = _Msg(ROLE_USER, new_user_message)
+            count += 1
+
+        del messages[count:]
+
         messages = self._ensure_alternating_roles(messages)
         messages = self._truncate_to_limit(messages)
-        
-        logger.info(f"Formatted {len(messages)} messages for Claude")
-        return messages
+
+        logger.debug("Formatted %d messages for Claude", len(messages))
+        return [{'role': msg.role, 'content': msg.content} for msg in messages]
     
     def _validate_message(self, message: Dict) -> bool:
         """Validate message format"""
-        if not isinstance(message, dict):
-            return False
-        
-        if 'role' not in message or 'content' not in message:
-            return False
-        
-        if message['role'] not in [ROLE_USER, ROLE_ASSISTANT]:
+        # EAFP: subscripting covers both non-dicts and missing keys;
+        # isspace() avoids allocating the stripped copy strip() would make
+        try:
+            role = message['role']
+            content = message['content']
+        except (TypeError, KeyError):
             return False
-        
-        if not isinstance(message['content'], str):
-            return False
-        
-        if not message['content'].strip():
-            return False
-        
-        return True
+
+        return (
+            role in _VALID_ROLES
+            and isinstance(content, str)
+            and bool(content)
+            and not content.isspace()
+        )
     
-    def _ensure_alternating_roles(self, messages: List[Dict]) -> List[Dict]:
+    def _ensure_alternating_roles(self, messages: List[_Msg]) -> List[_Msg]:
         """Ensure messages alternate between user and assistant"""
         if not messages:
             return messages
-        
-        if messages[0]['role'] != ROLE_USER:
-            while messages and messages[0]['role'] != ROLE_USER:
-                messages.pop(0)
-        
+
+        # Skip leading non-user messages by index (no O(n) pop(0) shifts),
+        # then dedup same-role runs in the same single sweep
+        start = next(
+            (i for i, msg in enumerate(messages) if msg.role == ROLE_USER),
+            len(messages)
+        )
+
         cleaned_messages = []
         last_role = None
-        
-        for msg in messages:
-            if msg['role'] != last_role:
+
+        for msg in messages[start:]:
+            role = msg.role
+            if role != last_role:
                 cleaned_messages.append(msg)
-                last_role = msg['role']
-        
+                last_role = role
+
         return cleaned_messages
     
-    def _truncate_to_limit(self, messages: List[Dict]) -> List[Dict]:
+    def _truncate_to_limit(self, messages: List[_Msg]) -> List[_Msg]:
         """Truncate conversation to stay within token limit"""
         if not messages:
             return messages
-        
-        total_chars = sum(len(msg['content']) for msg in messages)
-        estimated_tokens = total_chars // CHARS_PER_TOKEN
-        
+
+        # Lengths were precomputed at append time; this pass is pure
+        # integer gathering, no str walks
+        lens = np.fromiter(
+            (msg.nchars for msg in messages),
+            dtype=np.uint32,
+            count=len(messages)
+        )
+        estimated_tokens = int(lens.sum()) // CHARS_PER_TOKEN
+
         if estimated_tokens <= self.max_tokens:
             return messages
-        
-        logger.info(f"Truncating conversation ({estimated_tokens} > {self.max_tokens})")
-        
-        truncated_messages = []
-        current_tokens = 0
-        
-        for msg in reversed(messages):
-            msg_tokens = len(msg['content']) // CHARS_PER_TOKEN
-            
-            if current_tokens + msg_tokens <= self.max_tokens:
-                truncated_messages.insert(0, msg)
-                current_tokens += msg_tokens
-            else:
-                break
-        
-        truncated_messages = self._ensure_alternating_roles(truncated_messages)
-        
-        logger.info(f"Truncated to {len(truncated_messages)} messages (~{current_tokens} tokens)")
-        
+
+        logger.info("Truncating conversation (%d > %d)", estimated_tokens, self.max_tokens)
+
+        max_chars = self.max_tokens * CHARS_PER_TOKEN
+        cut = int(_truncate_index(lens, max_chars))
+
+        truncated_messages = messages[cut:]
+        current_tokens = int(lens[cut:].sum()) // CHARS_PER_TOKEN
+
+        # Slicing preserves internal alternation; only re-clean when the
+        # cut left a non-user message at the front
+        if truncated_messages and truncated_messages[0].role != ROLE_USER:
+            truncated_messages = self._ensure_alternating_roles(truncated_messages)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Truncated to %d messages (~%d tokens)",
+                len(truncated_messages), current_tokens
+            )
+
         return truncated_messages
@@ -1,57 +1,191 @@
 """
 Central Configuration for Glamhairshop Assistant
-Loads environment variables and provides app-wide config
+Loads environment variables once into a frozen Config dataclass
 """
 
+import logging
 import os
+from dataclasses import dataclass
+from enum import IntEnum
 from pathlib import Path
+from typing import Tuple
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 # ============================================
-# Paths
+# Config dataclass
 # ============================================
-BASE_DIR = Path(__file__).parent.parent
-DATA_DIR = BASE_DIR / 'data'
-LOGS_DIR = BASE_DIR / 'logs'
+# Frozen + slotted: every setting is read and coerced exactly once at
+# import, and downstream attribute access is a C slot read instead of a
+# module-global dict lookup.
 
-# Ensure directories exist
-LOGS_DIR.mkdir(exist_ok=True)
-(DATA_DIR / 'products').mkdir(parents=True, exist_ok=True)
-(DATA_DIR / 'embeddings').mkdir(parents=True, exist_ok=True)
-(DATA_DIR / 'raw').mkdir(parents=True, exist_ok=True)
+@dataclass(frozen=True, slots=True)
+class Config:
+    # Paths
+    base_dir: Path
+    data_dir: Path
+    logs_dir: Path
 
-# ============================================
-# Anthropic API Configuration
-# ============================================
-ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
-if not ANTHROPIC_API_KEY:
-    raise ValueError("ANTHROPIC_API_KEY not found in environment variables")
+    # Anthropic API
+    anthropic_api_key: str
+    model_name: str
+    model_temperature: float
+    max_tokens: int
+    max_concurrent_calls: int
+
+    # Flask
+    flask_env: str
+    flask_debug: bool
+    secret_key: str
+    port: int
+    host: str
+
+    # RAG
+    embedding_model: str
+    top_k_products: int
+    rerank_top_n: int
+
+    # Categories
+    enabled_categories: Tuple[str, ...]
+
+    # CORS
+    cors_origins: Tuple[str, ...]
+
+    # Analytics
+    umami_website_id: str
+    umami_script_url: str
+
+    # Logging
+    log_level: str
+    log_file: Path
+
+    # Rate limiting
+    rate_limit_per_minute: int
+    rate_limit_per_hour: int
+
+    # Feature flags
+    enable_comparator: bool
+    enable_query_enrichment: bool
+    enable_analytics: bool
+
+    # Languages
+    supported_languages: Tuple[str, ...]
+    default_language: str
+
+    # Sessions
+    session_timeout_minutes: int
+    max_conversation_history: int
+
+def _load_config() -> Config:
+    """Read environment, create directories, validate — runs once"""
+    load_dotenv()
+
+    base_dir = Path(__file__).parent.parent
+    data_dir = base_dir / 'data'
+    logs_dir = base_dir / 'logs'
+
+    # Ensure directories exist
+    logs_dir.mkdir(exist_ok=True)
+    (data_dir / 'products').mkdir(parents=True, exist_ok=True)
+    (data_dir / 'embeddings').mkdir(parents=True, exist_ok=True)
+    (data_dir / 'raw').mkdir(parents=True, exist_ok=True)
+
+    anthropic_api_key = os.getenv('ANTHROPIC_API_KEY')
+    if not anthropic_api_key:
+        raise ValueError("ANTHROPIC_API_KEY not found in environment variables")
+
+    config = Config(
+        base_dir=base_dir,
+        data_dir=data_dir,
+        logs_dir=logs_dir,
+        anthropic_api_key=anthropic_api_key,
+        model_name=os.getenv('MODEL_NAME', 'claude-sonnet-4-20250514'),
+        model_temperature=float(os.getenv('MODEL_TEMPERATURE', '0.7')),
+        max_tokens=int(os.getenv('MAX_TOKENS', '2000')),
+        max_concurrent_calls=int(os.getenv('MAX_CONCURRENT_CALLS', '5')),
+        flask_env=os.getenv('FLASK_ENV', 'development'),
+        flask_debug=os.getenv('FLASK_DEBUG', 'True').lower() == 'true',
+        secret_key=os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production'),
+        port=int(os.getenv('PORT', '5000')),
+        host=os.getenv('HOST', '0.0.0.0'),
+        embedding_model=os.getenv(
+            'EMBEDDING_MODEL',
+            'paraphrase-multilingual-mpnet-base-v2'
+        ),
+        top_k_products=int(os.getenv('TOP_K_PRODUCTS', '20')),
+        rerank_top_n=int(os.getenv('RERANK_TOP_N', '10')),
+        enabled_categories=tuple(
+            os.getenv('ENABLED_CATEGORIES', 'haircare,parrucchiere').split(',')
+        ),
+        cors_origins=tuple(
+            os.getenv(
+                'CORS_ORIGINS',
+                'http://localhost:5000,https://www.glamhairshop.it'
+            ).split(',')
+        ),
+        umami_website_id=os.getenv('UMAMI_WEBSITE_ID'),
+        umami_script_url=os.getenv(
+            'UMAMI_SCRIPT_URL',
+            'https://cloud.umami.is/script.js'
+        ),
+        log_level=os.getenv('LOG_LEVEL', 'INFO'),
+        log_file=logs_dir / os.getenv('LOG_FILE', 'app.log'),
+        rate_limit_per_minute=int(os.getenv('RATE_LIMIT_PER_MINUTE', '20')),
+        rate_limit_per_hour=int(os.getenv('RATE_LIMIT_PER_HOUR', '200')),
+        enable_comparator=os.getenv('ENABLE_COMPARATOR', 'true').lower() == 'true',
+        enable_query_enrichment=os.getenv('ENABLE_QUERY_ENRICHMENT', 'true').lower() == 'true',
+        enable_analytics=os.getenv('ENABLE_ANALYTICS', 'true').lower() == 'true',
+        supported_languages=('it', 'en', 'de', 'fr', 'es'),
+        default_language='it',
+        session_timeout_minutes=30,
+        max_conversation_history=10,  # Keep last 10 messages
+    )
 
-MODEL_NAME = os.getenv('MODEL_NAME', 'claude-sonnet-4-20250514')
-MODEL_TEMPERATURE = float(os.getenv('MODEL_TEMPERATURE', '0.7'))
-MAX_TOKENS = int(os.getenv('MAX_TOKENS', '2000'))
+    validate_config(config)
+    return config
 
 # ============================================
-# Flask Configuration
+# Validation
 # ============================================
-FLASK_ENV = os.getenv('FLASK_ENV', 'development')
-FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
-SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
-PORT = int(os.getenv('PORT', '5000'))
-HOST = os.getenv('HOST', '0.0.0.0')
+def validate_config(config: Config):
+    """Validate critical configuration"""
+    errors = []
+
+    if not config.anthropic_api_key or config.anthropic_api_key == 'your-api-key':
+        errors.append("ANTHROPIC_API_KEY not properly configured")
+
+    if (config.flask_env == 'production'
+            and config.secret_key == 'dev-secret-key-change-in-production'):
+        errors.append("SECRET_KEY must be changed in production")
+
+    if errors:
+        raise ValueError(f"Configuration errors: {', '.join(errors)}")
+
+CONFIG = _load_config()
 
 # ============================================
-# RAG Configuration
+# Backward-compatible module-level names
 # ============================================
-EMBEDDING_MODEL = os.getenv(
-    'EMBEDDING_MODEL',
-    'paraphrase-multilingual-mpnet-base-v2'
-)
-TOP_K_PRODUCTS = int(os.getenv('TOP_K_PRODUCTS', '20'))
-RERANK_TOP_N = int(os.getenv('RERANK_TOP_N', '10'))
+BASE_DIR = CONFIG.base_dir
+DATA_DIR = CONFIG.data_dir
+LOGS_DIR = CONFIG.logs_dir
+
+ANTHROPIC_API_KEY = CONFIG.anthropic_api_key
+MODEL_NAME = CONFIG.model_name
+MODEL_TEMPERATURE = CONFIG.model_temperature
+MAX_TOKENS = CONFIG.max_tokens
+MAX_CONCURRENT_CALLS = CONFIG.max_concurrent_calls
+
+FLASK_ENV = CONFIG.flask_env
+FLASK_DEBUG = CONFIG.flask_debug
+SECRET_KEY = CONFIG.secret_key
+PORT = CONFIG.port
+HOST = CONFIG.host
+
+EMBEDDING_MODEL = CONFIG.embedding_model
+TOP_K_PRODUCTS = CONFIG.top_k_products
+RERANK_TOP_N = CONFIG.rerank_top_n
 
 # Product data paths
 HAIRCARE_PRODUCTS_PATH = DATA_DIR / 'products' / 'haircare_products.json'
@@ -61,123 +195,123 @@ PARRUCCHIERE_PRODUCTS_PATH = DATA_DIR / 'products' / 'parrucchiere_products.json
 HAIRCARE_EMBEDDINGS_PATH = DATA_DIR / 'embeddings' / 'haircare_embeddings.pkl'
 PARRUCCHIERE_EMBEDDINGS_PATH = DATA_DIR / 'embeddings' / 'parrucchiere_embeddings.pkl'
 
+ENABLED_CATEGORIES = list(CONFIG.enabled_categories)
+
 # ============================================
 # Categories
 # ============================================
-ENABLED_CATEGORIES = os.getenv('ENABLED_CATEGORIES', 'haircare,parrucchiere').split(',')
+# Tuples of frozen records indexed by Category: O(1) index access
+# instead of two hashed dict lookups per field, and the float boosts can
+# be packed into a flat numpy vector by scoring code.
+
+class Category(IntEnum):
+    HAIRCARE = 0
+    PARRUCCHIERE = 1
 
+@dataclass(frozen=True, slots=True)
+class CategoryInfo:
+    name: str
+    description: str
+    products_path: Path
+    embeddings_path: Path
+
+CATEGORY_INFO: Tuple[CategoryInfo, ...] = (
+    CategoryInfo(
+        name='Hair Care',
+        description='Prodotti per la cura dei capelli (B2C)',
+        products_path=HAIRCARE_PRODUCTS_PATH,
+        embeddings_path=HAIRCARE_EMBEDDINGS_PATH,
+    ),
+    CategoryInfo(
+        name='Parrucchiere',
+        description='Prodotti e attrezzature professionali (B2B)',
+        products_path=PARRUCCHIERE_PRODUCTS_PATH,
+        embeddings_path=PARRUCCHIERE_EMBEDDINGS_PATH,
+    ),
+)
+
+@dataclass(frozen=True, slots=True)
+class HaircareBoosts:
+    brand: float = 1.3
+    problem: float = 1.6
+    hair_type: float = 1.4
+    goal: float = 1.3
+    budget: float = 1.2
+    wrong_category: float = 0.05
+
+@dataclass(frozen=True, slots=True)
+class ParrucchiereBoosts:
+    brand: float = 1.2
+    tool_type: float = 1.5
+    usage: float = 1.4
+    tech: float = 1.3
+    wrong_subcategory: float = 0.1
+
+MATCH_BOOSTS: Tuple = (HaircareBoosts(), ParrucchiereBoosts())
+
+# Legacy dict views (derived from the records above)
 CATEGORY_CONFIG = {
     'haircare': {
-        'name': 'Hair Care',
-        'description': 'Prodotti per la cura dei capelli (B2C)',
-        'products_path': HAIRCARE_PRODUCTS_PATH,
-        'embeddings_path': HAIRCARE_EMBEDDINGS_PATH,
+        'name': CATEGORY_INFO[Category.HAIRCARE].name,
+        'description': CATEGORY_INFO[Category.HAIRCARE].description,
+        'products_path': CATEGORY_INFO[Category.HAIRCARE].products_path,
+        'embeddings_path': CATEGORY_INFO[Category.HAIRCARE].embeddings_path,
     },
     'parrucchiere': {
-        'name': 'Parrucchiere',
-        'description': 'Prodotti e attrezzature professionali (B2B)',
-        'products_path': PARRUCCHIERE_PRODUCTS_PATH,
-        'embeddings_path': PARRUCCHIERE_EMBEDDINGS_PATH,
+        'name': CATEGORY_INFO[Category.PARRUCCHIERE].name,
+        'description': CATEGORY_INFO[Category.PARRUCCHIERE].description,
+        'products_path': CATEGORY_INFO[Category.PARRUCCHIERE].products_path,
+        'embeddings_path': CATEGORY_INFO[Category.PARRUCCHIERE].embeddings_path,
     }
 }
 
-# ============================================
-# CORS Configuration
-# ============================================
-CORS_ORIGINS = os.getenv(
-    'CORS_ORIGINS',
-    'http://localhost:5000,https://www.glamhairshop.it'
-).split(',')
+CORS_ORIGINS = list(CONFIG.cors_origins)
 
-# ============================================
-# Analytics
-# ============================================
-UMAMI_WEBSITE_ID = os.getenv('UMAMI_WEBSITE_ID')
-UMAMI_SCRIPT_URL = os.getenv(
-    'UMAMI_SCRIPT_URL',
-    'https://cloud.umami.is/script.js'
-)
+UMAMI_WEBSITE_ID = CONFIG.umami_website_id
+UMAMI_SCRIPT_URL = CONFIG.umami_script_url
 
-# ============================================
-# Logging
-# ============================================
-LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
-LOG_FILE = LOGS_DIR / os.getenv('LOG_FILE', 'app.log')
+LOG_LEVEL = CONFIG.log_level
+LOG_FILE = CONFIG.log_file
 
-# ============================================
-# Rate Limiting
-# ============================================
-RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', '20'))
-RATE_LIMIT_PER_HOUR = int(os.getenv('RATE_LIMIT_PER_HOUR', '200'))
+RATE_LIMIT_PER_MINUTE = CONFIG.rate_limit_per_minute
+RATE_LIMIT_PER_HOUR = CONFIG.rate_limit_per_hour
 
-# ============================================
-# Feature Flags
-# ============================================
-ENABLE_COMPARATOR = os.getenv('ENABLE_COMPARATOR', 'true').lower() == 'true'
-ENABLE_QUERY_ENRICHMENT = os.getenv('ENABLE_QUERY_ENRICHMENT', 'true').lower() == 'true'
-ENABLE_ANALYTICS = os.getenv('ENABLE_ANALYTICS', 'true').lower() == 'true'
+ENABLE_COMPARATOR = CONFIG.enable_comparator
+ENABLE_QUERY_ENRICHMENT = CONFIG.enable_query_enrichment
+ENABLE_ANALYTICS = CONFIG.enable_analytics
 
-# ============================================
-# Languages
-# ============================================
-SUPPORTED_LANGUAGES = ['it', 'en', 'de', 'fr', 'es']
-DEFAULT_LANGUAGE = 'it'
+SUPPORTED_LANGUAGES = list(CONFIG.supported_languages)
+DEFAULT_LANGUAGE = CONFIG.default_language
 
-# ============================================
-# Session Configuration
-# ============================================
-SESSION_TIMEOUT_MINUTES = 30
-MAX_CONVERSATION_HISTORY = 10  # Keep last 10 messages
+SESSION_TIMEOUT_MINUTES = CONFIG.session_timeout_minutes
+MAX_CONVERSATION_HISTORY = CONFIG.max_conversation_history
 
 # ============================================
-# Product Matching Configuration
+# Product Matching Configuration (legacy dict view)
 # ============================================
 MATCH_CONFIG = {
     'haircare': {
-        'boost_brand_match': 1.3,
-        'boost_problem_match': 1.6,
-        'boost_hair_type_match': 1.4,
-        'boost_goal_match': 1.3,
-        'boost_budget_match': 1.2,
-        'penalty_wrong_category': 0.05
+        'boost_brand_match': MATCH_BOOSTS[Category.HAIRCARE].brand,
+        'boost_problem_match': MATCH_BOOSTS[Category.HAIRCARE].problem,
+        'boost_hair_type_match': MATCH_BOOSTS[Category.HAIRCARE].hair_type,
+        'boost_goal_match': MATCH_BOOSTS[Category.HAIRCARE].goal,
+        'boost_budget_match': MATCH_BOOSTS[Category.HAIRCARE].budget,
+        'penalty_wrong_category': MATCH_BOOSTS[Category.HAIRCARE].wrong_category,
     },
     'parrucchiere': {
-        'boost_brand_match': 1.2,
-        'boost_tool_type_match': 1.5,
-        'boost_usage_match': 1.4,
-        'boost_tech_match': 1.3,
-        'penalty_wrong_subcategory': 0.1
+        'boost_brand_match': MATCH_BOOSTS[Category.PARRUCCHIERE].brand,
+        'boost_tool_type_match': MATCH_BOOSTS[Category.PARRUCCHIERE].tool_type,
+        'boost_usage_match': MATCH_BOOSTS[Category.PARRUCCHIERE].usage,
+        'boost_tech_match': MATCH_BOOSTS[Category.PARRUCCHIERE].tech,
+        'penalty_wrong_subcategory': MATCH_BOOSTS[Category.PARRUCCHIERE].wrong_subcategory,
     }
 }
 
-# ============================================
-# Validation
-# ============================================
-def validate_config():
-    """Validate critical configuration"""
-    errors = []
-    
-    if not ANTHROPIC_API_KEY or ANTHROPIC_API_KEY == 'your-api-key':
-        errors.append("ANTHROPIC_API_KEY not properly configured")
-    
-    if FLASK_ENV == 'production' and SECRET_KEY == 'dev-secret-key-change-in-production':
-        errors.append("SECRET_KEY must be changed in production")
-    
-    if errors:
-        raise ValueError(f"Configuration errors: {', '.join(errors)}")
-
-# Run validation on import
-validate_config()
-
-# ============================================
-# Debug Print (only in development)
-# ============================================
-if FLASK_DEBUG:
-    print("=" * 60)
-    print("GLAMHAIRSHOP ASSISTANT - Configuration Loaded")
-    print("=" * 60)
-    print(f"Environment: {FLASK_ENV}")
-    print(f"Model: {MODEL_NAME}")
-    print(f"Categories: {', '.join(ENABLED_CATEGORIES)}")
-    print(f"Port: {PORT}")
-    print("=" * 60)
+if CONFIG.flask_debug:
+    logger.debug(
+        "Configuration loaded (env=%s, model=%s, categories=%s, port=%d)",
+        CONFIG.flask_env,
+        CONFIG.model_name,
+        ','.join(CONFIG.enabled_categories),
+        CONFIG.port,
+    )
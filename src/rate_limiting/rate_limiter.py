@@ -7,14 +7,30 @@ Author: Peppe
 Date: 2026-01-22
 """
 
-import time
+import importlib.util
+import json
 import yaml
 import logging
+
+try:
+    # libyaml-backed loader: ~10x faster than the pure-Python default;
+    # ships with most PyYAML wheels but is optional at build time
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+try:
+    from src.rate_limiting.token_bucket import TokenBucket
+except ImportError:
+    # Running as a plain script (self-test below)
+    from token_bucket import TokenBucket
 from datetime import datetime, timedelta, date
+from heapq import heappush, heappop
 from pathlib import Path
-from typing import Dict, Optional, List, Any
+from random import random
+from time import monotonic
+from typing import Dict, NamedTuple, Optional, List, Any
 from threading import Lock
-import hashlib
 
 # ============================================
 # LOGGING SETUP
@@ -26,113 +42,269 @@ logging.basicConfig(
 )
 logger = logging.getLogger('rate_limiter')
 
+# ============================================
+# DATE CACHE
+# ============================================
+# date.today().isoformat() formats a fresh string on every call, but
+# the answer only changes once a day — cache the string and refresh
+# lazily when the local day flips. The cache key must be the local
+# ordinal, not the UTC epoch day, or counters keep accruing into
+# yesterday's keys for a couple of hours after midnight CET/CEST.
+
+_TODAY_CACHE = {'day': -1, 'iso': ''}
+
+def _today_iso() -> str:
+    """Today's ISO date, reformatted at most once per day"""
+    today = date.today()
+    day = today.toordinal()
+    if day != _TODAY_CACHE['day']:
+        _TODAY_CACHE['iso'] = today.isoformat()
+        _TODAY_CACHE['day'] = day
+    return _TODAY_CACHE['iso']
+
 # ============================================
 # IN-MEMORY STORAGE (Development)
 # ============================================
 
+# Expired keys are also swept proactively every N writes so the store
+# stays bounded under session churn instead of growing until restart
+_SWEEP_EVERY_WRITES = 64
+
 class InMemoryStorage:
-    """In-memory storage backend with TTL support"""
-    
+    """
+    In-memory storage backend with TTL support
+
+    Values are stored as native Python objects (int, float, str, set) —
+    stringifying only happens at a boundary that needs it, never on the
+    request hot path. Expiries are monotonic-clock floats (no datetime
+    allocation per op, immune to wall-clock jumps) tracked in a heap for
+    cheap proactive sweeping.
+    """
+
     def __init__(self):
         self.store = {}
-        self.expiry = {}
+        self.expiry = {}   # key -> monotonic deadline
+        self._heap = []    # (deadline, key); may hold stale entries
+        self._writes = 0
         self.lock = Lock()
-    
-    def get(self, key: str) -> Optional[str]:
-        """Get value with expiry check"""
+
+    def _expired(self, key: str, now: float) -> bool:
+        """Drop key if past its deadline (caller holds the lock)"""
+        deadline = self.expiry.get(key)
+        if deadline is not None and now > deadline:
+            del self.store[key]
+            del self.expiry[key]
+            return True
+        return False
+
+    def _set_expiry(self, key: str, ttl: int, now: float):
+        """Register a deadline and occasionally sweep (lock held)"""
+        deadline = now + ttl
+        self.expiry[key] = deadline
+        heappush(self._heap, (deadline, key))
+
+        self._writes += 1
+        if self._writes >= _SWEEP_EVERY_WRITES:
+            self._writes = 0
+            self._sweep(now)
+
+    def _sweep(self, now: float):
+        """Pop expired heap entries; stale ones (rewritten keys) skipped"""
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, key = heappop(heap)
+            if self.expiry.get(key, float('inf')) <= now:
+                self.store.pop(key, None)
+                self.expiry.pop(key, None)
+
+    def get(self, key: str, now: Optional[float] = None) -> Optional[Any]:
+        """Get value with expiry check (pass now to reuse a clock read)"""
         with self.lock:
-            # Check expiry
-            if key in self.expiry and datetime.now() > self.expiry[key]:
-                del self.store[key]
-                del self.expiry[key]
+            if now is None:
+                now = monotonic()
+            if self._expired(key, now):
                 return None
-            
+
             return self.store.get(key)
-    
+
     def set(self, key: str, value: str, ttl: int):
         """Set value with TTL (seconds)"""
         with self.lock:
             self.store[key] = value
-            self.expiry[key] = datetime.now() + timedelta(seconds=ttl)
-    
+            self._set_expiry(key, ttl, monotonic())
+
     def incr(self, key: str, ttl: int) -> int:
         """Increment counter with TTL"""
         with self.lock:
-            # Check expiry
-            if key in self.expiry and datetime.now() > self.expiry[key]:
-                del self.store[key]
-                del self.expiry[key]
-            
-            # Increment
-            current = int(self.store.get(key, 0))
-            current += 1
-            self.store[key] = str(current)
-            
+            now = monotonic()
+            self._expired(key, now)
+
+            # Increment (kept as a native int — no str round-trip)
+            current = self.store.get(key, 0) + 1
+            self.store[key] = current
+
             # Set expiry if first increment
             if current == 1:
-                self.expiry[key] = datetime.now() + timedelta(seconds=ttl)
-            
+                self._set_expiry(key, ttl, now)
+
             return current
-    
+
     def incr_float(self, key: str, amount: float, ttl: int):
         """Increment float value with TTL"""
         with self.lock:
-            # Check expiry
-            if key in self.expiry and datetime.now() > self.expiry[key]:
-                del self.store[key]
-                del self.expiry[key]
-            
-            # Increment
-            current = float(self.store.get(key, 0))
-            current += amount
-            self.store[key] = str(current)
-            
+            now = monotonic()
+            self._expired(key, now)
+
+            # Increment (kept as a native float — no str round-trip)
+            current = self.store.get(key, 0.0) + amount
+            self.store[key] = current
+
             # Set expiry if first increment
             if current == amount:
-                self.expiry[key] = datetime.now() + timedelta(seconds=ttl)
-    
-    def exists(self, key: str) -> bool:
+                self._set_expiry(key, ttl, now)
+
+    def multi_get_counters(self, keys, now: Optional[float] = None) -> List[tuple]:
+        """
+        Read several counters under a single lock acquisition
+
+        Returns one (value, ttl_seconds) pair per key, in order; expired
+        or missing keys read as (0, 0). Values are returned native —
+        callers coerce with int()/float() as they do for get().
+        """
+        with self.lock:
+            if now is None:
+                now = monotonic()
+
+            out = []
+            for key in keys:
+                if self._expired(key, now):
+                    out.append((0, 0))
+                    continue
+
+                deadline = self.expiry.get(key)
+                ttl = max(0, int(deadline - now)) if deadline is not None else 0
+                out.append((self.store.get(key, 0), ttl))
+
+            return out
+
+    def exists(self, key: str, now: Optional[float] = None) -> bool:
         """Check if key exists and not expired"""
-        return self.get(key) is not None
-    
-    def ttl(self, key: str) -> int:
+        return self.get(key, now) is not None
+
+    def ttl(self, key: str, now: Optional[float] = None) -> int:
         """Get remaining TTL in seconds"""
         with self.lock:
-            if key not in self.expiry:
+            deadline = self.expiry.get(key)
+            if deadline is None:
                 return 0
-            
-            remaining = (self.expiry[key] - datetime.now()).total_seconds()
-            return max(0, int(remaining))
-    
+
+            if now is None:
+                now = monotonic()
+            return max(0, int(deadline - now))
+
     def sadd(self, key: str, value: str, ttl: int):
         """Add to set with TTL"""
         with self.lock:
-            # Check expiry
-            if key in self.expiry and datetime.now() > self.expiry[key]:
-                del self.store[key]
-                del self.expiry[key]
-            
-            # Get or create set
-            current_set = eval(self.store.get(key, '[]'))
-            if value not in current_set:
-                current_set.append(value)
-            
-            self.store[key] = str(current_set)
-            self.expiry[key] = datetime.now() + timedelta(seconds=ttl)
-    
+            now = monotonic()
+            self._expired(key, now)
+
+            # Get or create a real set — O(1) membership and add
+            current_set = self.store.get(key)
+            if not isinstance(current_set, set):
+                current_set = set()
+                self.store[key] = current_set
+
+            current_set.add(value)
+            self._set_expiry(key, ttl, now)
+
     def scard(self, key: str) -> int:
         """Get set cardinality"""
         with self.lock:
-            # Check expiry
-            if key in self.expiry and datetime.now() > self.expiry[key]:
-                del self.store[key]
-                del self.expiry[key]
+            if self._expired(key, monotonic()):
                 return 0
-            
-            if key not in self.store:
+
+            current_set = self.store.get(key)
+            if not isinstance(current_set, set):
                 return 0
-            
-            return len(eval(self.store[key]))
+
+            return len(current_set)
+
+# ============================================
+# DECISION
+# ============================================
+
+class Decision(NamedTuple):
+    """
+    Outcome of a rate-limit check
+
+    NamedTuple instead of a per-call dict: no hash table built per
+    request, attribute access instead of string-keyed lookups, and the
+    common all-clear outcome is a shared constant so the steady-state
+    check allocates nothing.
+    """
+    allowed: bool
+    throttled: bool = False
+    delay: int = 0
+    reason: str = ''
+    retry_after: int = 0
+    message: str = ''
+    whitelisted: bool = False
+
+_ALLOW = Decision(allowed=True)
+
+# ============================================
+# LOAD SHEDDER
+# ============================================
+
+class _LoadShedder:
+    """
+    Probabilistic admission gate for overload protection.
+
+    Keeps a 256-entry probability table indexed by the previous
+    second's load relative to limit_rps: 1.0 up to the limit, then a
+    linear ramp down to a 0.05 floor at 4x the limit. Under overload a
+    shed request costs one PRNG draw and a compare — no bucket state,
+    no counter reads — so excess traffic doesn't amplify CPU use. The
+    load index refreshes lazily once per second.
+    """
+
+    __slots__ = ('_limit_rps', '_lut', '_window_sec', '_window_count',
+                 '_idx', '_lock')
+
+    _LUT_SIZE = 256
+    _MAX_RATIO = 4.0
+
+    def __init__(self, limit_rps: float):
+        self._limit_rps = max(1.0, float(limit_rps))
+        step = self._MAX_RATIO / (self._LUT_SIZE - 1)
+        self._lut = [
+            1.0 if i * step <= 1.0
+            else max(0.05, 1.0 - (i * step - 1.0) / (self._MAX_RATIO - 1.0))
+            for i in range(self._LUT_SIZE)
+        ]
+        self._window_sec = -1
+        self._window_count = 0
+        self._idx = 0
+        self._lock = Lock()
+
+    def admit(self, mono: float) -> bool:
+        """Count this request and decide whether to admit it"""
+        sec = int(mono)
+        if sec != self._window_sec:
+            with self._lock:
+                if sec != self._window_sec:
+                    ratio = self._window_count / self._limit_rps
+                    self._idx = min(
+                        self._LUT_SIZE - 1,
+                        int(ratio / self._MAX_RATIO * (self._LUT_SIZE - 1))
+                    )
+                    self._window_sec = sec
+                    self._window_count = 0
+        self._window_count += 1
+        prob = self._lut[self._idx]
+        # random() < 1.0 always, so the fast path under normal load
+        # never sheds
+        return prob >= 1.0 or random() < prob
 
 # ============================================
 # RATE LIMITER
@@ -140,7 +312,16 @@ class InMemoryStorage:
 
 class RateLimiter:
     """Multi-layer rate limiter with cost protection"""
-    
+
+    __slots__ = (
+        'config', 'storage', '_bucket', '_shedder',
+        '_rpm', '_rph', '_rpd',
+        '_max_messages', '_max_duration', '_max_sessions_per_ip',
+        '_max_conversations', '_daily_budget',
+        '_emergency_stop', '_throttle_threshold', '_warning_threshold',
+        '_whitelist_ips', '_whitelist_sessions',
+    )
+
     def __init__(self, config_path: str, use_redis: bool = False):
         """
         Initialize rate limiter
@@ -157,26 +338,111 @@ class RateLimiter:
             raise NotImplementedError("Redis backend not yet implemented")
         else:
             self.storage = InMemoryStorage()
-        
+
+        # Hot-path numbers flattened into slotted attributes: one
+        # C-level offset load per limit instead of nested dict probes
+        # on every check.
+        ip_limits = self.config['ip_limits']
+        session_limits = self.config['session_limits']
+        global_limits = self.config['global_limits']
+        self._rpm = ip_limits['requests_per_minute']
+        self._rph = ip_limits['requests_per_hour']
+        self._rpd = ip_limits['requests_per_day']
+        self._max_messages = session_limits['max_messages']
+        self._max_duration = timedelta(
+            minutes=session_limits['max_duration_minutes'])
+        self._max_sessions_per_ip = session_limits['max_sessions_per_ip_per_day']
+        self._max_conversations = global_limits['max_conversations_per_day']
+        self._daily_budget = global_limits['max_cost_per_day_usd']
+        self._emergency_stop = global_limits['emergency_stop']
+        self._throttle_threshold = global_limits['throttle_threshold']
+        self._warning_threshold = global_limits['warning_threshold']
+        self._whitelist_ips = self.config['_whitelist_ips']
+        self._whitelist_sessions = self.config['_whitelist_sessions']
+
+        # Layer 0: per-IP burst smoothing. Capacity is the per-minute
+        # allowance plus burst_allowance; refill matches the per-minute
+        # rate, so short bursts are absorbed without touching counters.
+        self._bucket = TokenBucket(
+            rate_per_sec=self._rpm / 60.0,
+            capacity=self._rpm + ip_limits.get('burst_allowance', 0),
+            max_keys=ip_limits.get('bucket_max_keys', 100_000),
+        )
+
+        # Overload shedding: sample requests away before any
+        # bookkeeping once sustained load exceeds shed_limit_rps
+        self._shedder = _LoadShedder(
+            global_limits.get('shed_limit_rps', 50)
+        )
+
         logger.info("✅ Rate limiter initialized (in-memory mode)")
     
     def _load_config(self, config_path: str) -> Dict:
-        """Load configuration from YAML"""
+        """Load configuration from YAML (with a JSON sidecar cache)"""
         config_file = Path(config_path)
-        
+
         if not config_file.exists():
             raise FileNotFoundError(f"Config file not found: {config_path}")
-        
-        with open(config_file, 'r') as f:
-            config = yaml.safe_load(f)
-        
-        logger.info(f"✅ Configuration loaded from {config_path}")
+
+        config = None
+        source = config_file
+
+        # Fastest path: a generated Python module (see
+        # scripts/generate_rate_limits_module.py) — the import machinery
+        # serves the cached .pyc, no parsing at all
+        py_file = config_file.with_suffix('.py')
+        try:
+            if py_file.stat().st_mtime >= config_file.stat().st_mtime:
+                spec = importlib.util.spec_from_file_location(
+                    '_rate_limits_generated', py_file
+                )
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                config = dict(module.LIMITS)
+                source = py_file
+        except Exception:
+            # Corrupt or half-written module (the generator may have
+            # been interrupted): fall back to the JSON/YAML chain
+            config = None
+
+        # YAML parsing dominates init time for a config this small; a
+        # JSON sidecar regenerated whenever the YAML is newer makes warm
+        # starts near-instant
+        json_file = config_file.with_suffix('.json')
+
+        if config is None:
+            try:
+                if json_file.stat().st_mtime >= config_file.stat().st_mtime:
+                    with open(json_file, 'r') as f:
+                        config = json.load(f)
+                    source = json_file
+            except (OSError, ValueError):
+                config = None
+
+        if config is None:
+            with open(config_file, 'r') as f:
+                config = yaml.load(f, Loader=_YamlLoader)
+
+            try:
+                with open(json_file, 'w') as f:
+                    json.dump(config, f)
+            except OSError:
+                pass  # read-only config dir: just re-parse YAML next time
+
+        # Whitelist membership is tested before any other work on every
+        # request — precompute frozensets instead of scanning the loaded
+        # lists each time
+        whitelist = config.get('whitelist', {}) or {}
+        config['_whitelist_ips'] = frozenset(whitelist.get('ips') or ())
+        config['_whitelist_sessions'] = frozenset(whitelist.get('sessions') or ())
+
+        logger.info(f"✅ Configuration loaded from {source}")
         return config
     
-    def check_request(self, 
-                     ip_address: str, 
+    def check_request(self,
+                     ip_address: str,
                      session_id: str,
-                     estimated_cost: float = 0.051) -> Dict[str, Any]:
+                     estimated_cost: float = 0.051) -> Decision:
         """
         Check if request is allowed
         
@@ -184,44 +450,142 @@ class RateLimiter:
             ip_address: Client IP address
             session_id: Session identifier
             estimated_cost: Estimated cost of this request
-            
+
+        Returns:
+            Decision(allowed, throttled, delay, reason, retry_after,
+            message, whitelisted)
+        """
+        return self._decide(ip_address, session_id, estimated_cost,
+                            record=False)
+
+    def try_acquire(self,
+                    ip_address: str,
+                    session_id: str,
+                    cost: float = 0.051) -> Decision:
+        """
+        Atomically check and consume one request
+
+        Fuses check_request + record_request into one pass: the request
+        is recorded the moment it is admitted, so two concurrent
+        requests can no longer both pass the check before either is
+        counted. Prefer this over the split pair when the recorded cost
+        is known up front.
+
+        Args:
+            ip_address: Client IP address
+            session_id: Session identifier
+            cost: Cost recorded for this request if admitted
+
         Returns:
-            {
-                'allowed': bool,
-                'throttled': bool,
-                'delay': int (seconds),
-                'reason': str,
-                'retry_after': int (seconds),
-                'message': str
-            }
+            Same Decision as check_request
         """
+        return self._decide(ip_address, session_id, cost, record=True)
+
+    def _decide(self, ip_address: str, session_id: str, cost: float,
+                record: bool) -> Decision:
+        """Run every layer once; optionally record on admission"""
         # Check whitelist
         if self._is_whitelisted(ip_address, session_id):
-            return {'allowed': True, 'whitelisted': True}
-        
+            return Decision(allowed=True, whitelisted=True)
+
+        mono = monotonic()
+
+        # Probabilistic shedding: under sustained overload most
+        # requests are refused here, before any bucket or counter work
+        if not self._shedder.admit(mono):
+            return Decision(
+                allowed=False,
+                reason='overload',
+                retry_after=1,
+                message=self.config['messages']['budget_exceeded'],
+            )
+
+        # Layer 0: token-bucket burst smoothing (per IP)
+        bucket_ok, retry_ms = self._bucket.try_acquire(f"tb:ip:{ip_address}")
+        if not bucket_ok:
+            retry_after = max(1, retry_ms // 1000)
+            return Decision(
+                allowed=False,
+                reason='burst_limit',
+                retry_after=retry_after,
+                message=self.config['messages']['rate_limit_ip'].format(
+                    retry_after=retry_after
+                ),
+            )
+
+        # One clock read per clock and one date format, shared by every
+        # layer (wall clock for session duration, monotonic for TTLs)
+        now = datetime.now()
+        today = _today_iso()
+
         # Layer 1: IP rate limiting
-        ip_check = self._check_ip_limits(ip_address)
-        if not ip_check['allowed']:
+        ip_check = self._check_ip_limits(ip_address, today, mono)
+        if not ip_check.allowed:
             return ip_check
-        
+
         # Layer 2: Session limits
-        session_check = self._check_session_limits(session_id, ip_address)
-        if not session_check['allowed']:
+        session_check = self._check_session_limits(session_id, ip_address, today, now, mono)
+        if not session_check.allowed:
             return session_check
-        
-        # Layer 3: Global system limits
-        global_check = self._check_global_limits(estimated_cost)
-        if not global_check['allowed']:
+
+        # Layer 3: Global system limits (may allow with throttling)
+        global_check = self._check_global_limits(cost, today, mono)
+        if not global_check.allowed:
             return global_check
-        
+
         # All checks passed
-        return {
-            'allowed': True,
-            'throttled': global_check.get('throttled', False),
-            'delay': global_check.get('delay', 0),
-        }
-    
-    def record_request(self, 
+        if record:
+            self._record(ip_address, session_id, cost, now, today)
+        return global_check
+
+    def check_requests(self,
+                       ip_address: str,
+                       session_id: str,
+                       n: int,
+                       estimated_cost: float = 0.051) -> int:
+        """
+        Check-and-record a burst of n requests in one call
+
+        Clocks are read once and shared across the whole batch; allowed
+        requests are recorded as they are consumed, so the batch sees
+        its own effect on the counters.
+
+        Args:
+            ip_address: Client IP address
+            session_id: Session identifier
+            n: Number of requests in the burst
+            estimated_cost: Estimated cost per request
+
+        Returns:
+            Bitmask where bit i is set when request i was allowed
+        """
+        if self._is_whitelisted(ip_address, session_id):
+            return (1 << n) - 1
+
+        now = datetime.now()
+        mono = monotonic()
+        today = _today_iso()
+        bucket_key = f"tb:ip:{ip_address}"
+
+        mask = 0
+        for i in range(n):
+            if not self._shedder.admit(mono):
+                continue
+            if not self._bucket.try_acquire(bucket_key)[0]:
+                continue
+            check = self._check_ip_limits(ip_address, today, mono)
+            if check.allowed:
+                check = self._check_session_limits(
+                    session_id, ip_address, today, now, mono)
+            if check.allowed:
+                check = self._check_global_limits(estimated_cost, today, mono)
+            if check.allowed:
+                mask |= 1 << i
+                self._record(ip_address, session_id, estimated_cost,
+                             now, today)
+        return mask
+
+    def record_request(self,
                       ip_address: str,
                       session_id: str,
                       cost: float):
@@ -233,180 +597,184 @@ class RateLimiter:
             session_id: Session identifier
             cost: Actual cost of the request
         """
-        today = date.today().isoformat()
-        
+        self._record(ip_address, session_id, cost,
+                     datetime.now(), _today_iso())
+
+    def _record(self, ip_address: str, session_id: str, cost: float,
+                now: datetime, today: str):
+        """Increment all counters for one allowed request"""
         # Increment counters
         self.storage.incr(f"ip:{ip_address}:minute", ttl=60)
         self.storage.incr(f"ip:{ip_address}:hour", ttl=3600)
         self.storage.incr(f"ip:{ip_address}:day:{today}", ttl=86400)
-        
+
         self.storage.incr(f"session:{session_id}:messages", ttl=1800)
         self.storage.incr(f"global:conversations:{today}", ttl=86400)
-        
+
         # Track costs
         self.storage.incr_float(f"global:cost:{today}", cost, ttl=86400)
-        
+
         # Track session start time (if new)
         session_key = f"session:{session_id}:start_time"
         if not self.storage.exists(session_key):
-            self.storage.set(session_key, datetime.now().isoformat(), ttl=1800)
+            self.storage.set(session_key, now.isoformat(), ttl=1800)
         
         # Add session to IP's daily sessions
         self.storage.sadd(f"ip:{ip_address}:sessions:{today}", session_id, ttl=86400)
     
-    def _check_ip_limits(self, ip_address: str) -> Dict[str, Any]:
+    def _check_ip_limits(self, ip_address: str, today: str, mono: float) -> Decision:
         """Check IP-based rate limits"""
-        limits = self.config['ip_limits']
-        today = date.today().isoformat()
-        
-        # Check minute limit
+        # One lock acquisition covers all three counters
         minute_key = f"ip:{ip_address}:minute"
-        minute_count = int(self.storage.get(minute_key) or 0)
-        
-        if minute_count >= limits['requests_per_minute']:
-            retry_after = self.storage.ttl(minute_key)
-            return {
-                'allowed': False,
-                'reason': 'rate_limit_minute',
-                'retry_after': retry_after,
-                'message': self.config['messages']['rate_limit_ip'].format(
+        hour_key = f"ip:{ip_address}:hour"
+        day_key = f"ip:{ip_address}:day:{today}"
+
+        (
+            (minute_count, minute_ttl),
+            (hour_count, hour_ttl),
+            (day_count, day_ttl),
+        ) = self.storage.multi_get_counters(
+            (minute_key, hour_key, day_key), mono
+        )
+
+        # Check minute limit
+        if int(minute_count or 0) >= self._rpm:
+            retry_after = minute_ttl
+            return Decision(
+                allowed=False,
+                reason='rate_limit_minute',
+                retry_after=retry_after,
+                message=self.config['messages']['rate_limit_ip'].format(
                     retry_after=retry_after
                 ),
-            }
+            )
         
         # Check hour limit
-        hour_key = f"ip:{ip_address}:hour"
-        hour_count = int(self.storage.get(hour_key) or 0)
-        
-        if hour_count >= limits['requests_per_hour']:
-            retry_after = self.storage.ttl(hour_key)
-            return {
-                'allowed': False,
-                'reason': 'rate_limit_hour',
-                'retry_after': retry_after // 60,
-                'message': self.config['messages']['rate_limit_ip'].format(
+        if int(hour_count or 0) >= self._rph:
+            retry_after = hour_ttl
+            return Decision(
+                allowed=False,
+                reason='rate_limit_hour',
+                retry_after=retry_after // 60,
+                message=self.config['messages']['rate_limit_ip'].format(
                     retry_after=f"{retry_after // 60} minutes"
                 ),
-            }
+            )
         
         # Check day limit
-        day_key = f"ip:{ip_address}:day:{today}"
-        day_count = int(self.storage.get(day_key) or 0)
-        
-        if day_count >= limits['requests_per_day']:
-            return {
-                'allowed': False,
-                'reason': 'rate_limit_day',
-                'retry_after': self.storage.ttl(day_key),
-                'message': self.config['messages']['daily_limit'],
-            }
-        
-        return {'allowed': True}
-    
-    def _check_session_limits(self, session_id: str, ip_address: str) -> Dict[str, Any]:
+        if int(day_count or 0) >= self._rpd:
+            return Decision(
+                allowed=False,
+                reason='rate_limit_day',
+                retry_after=day_ttl,
+                message=self.config['messages']['daily_limit'],
+            )
+
+        return _ALLOW
+
+    def _check_session_limits(self, session_id: str, ip_address: str,
+                              today: str, now: datetime, mono: float) -> Decision:
         """Check session-based limits"""
-        limits = self.config['session_limits']
-        today = date.today().isoformat()
-        
         # Check message count
         message_key = f"session:{session_id}:messages"
-        message_count = int(self.storage.get(message_key) or 0)
+        message_count = int(self.storage.get(message_key, mono) or 0)
         
-        if message_count >= limits['max_messages']:
-            return {
-                'allowed': False,
-                'reason': 'session_message_limit',
-                'message': self.config['messages']['rate_limit_session'],
-            }
+        if message_count >= self._max_messages:
+            return Decision(
+                allowed=False,
+                reason='session_message_limit',
+                message=self.config['messages']['rate_limit_session'],
+            )
         
         # Check session duration
         start_time_key = f"session:{session_id}:start_time"
-        start_time_str = self.storage.get(start_time_key)
-        
+        start_time_str = self.storage.get(start_time_key, mono)
+
         if start_time_str:
             start_time = datetime.fromisoformat(start_time_str)
-            duration = datetime.now() - start_time
-            max_duration = timedelta(minutes=limits['max_duration_minutes'])
-            
-            if duration > max_duration:
-                return {
-                    'allowed': False,
-                    'reason': 'session_expired',
-                    'message': self.config['messages']['session_expired'],
-                }
+            duration = now - start_time
+
+            if duration > self._max_duration:
+                return Decision(
+                    allowed=False,
+                    reason='session_expired',
+                    message=self.config['messages']['session_expired'],
+                )
         
         # Check daily sessions per IP
         sessions_key = f"ip:{ip_address}:sessions:{today}"
         daily_sessions = self.storage.scard(sessions_key)
         
-        if daily_sessions >= limits['max_sessions_per_ip_per_day']:
-            return {
-                'allowed': False,
-                'reason': 'daily_session_limit',
-                'message': 'Daily session limit reached. Try again tomorrow.',
-            }
-        
-        return {'allowed': True}
-    
-    def _check_global_limits(self, estimated_cost: float) -> Dict[str, Any]:
+        if daily_sessions >= self._max_sessions_per_ip:
+            return Decision(
+                allowed=False,
+                reason='daily_session_limit',
+                message='Daily session limit reached. Try again tomorrow.',
+            )
+
+        return _ALLOW
+
+    def _check_global_limits(self, estimated_cost: float,
+                             today: str, mono: float) -> Decision:
         """Check global system limits"""
-        limits = self.config['global_limits']
-        today = date.today().isoformat()
-        
-        # Check daily conversation count
+        # Both global counters read under one lock acquisition
         conv_key = f"global:conversations:{today}"
-        daily_count = int(self.storage.get(conv_key) or 0)
+        cost_key = f"global:cost:{today}"
+        (daily_count_raw, _), (daily_cost_raw, _) = self.storage.multi_get_counters(
+            (conv_key, cost_key), mono
+        )
+
+        # Check daily conversation count
+        daily_count = int(daily_count_raw or 0)
         
-        if daily_count >= limits['max_conversations_per_day']:
+        if daily_count >= self._max_conversations:
             self._send_alert('critical', 'traffic', 
                            f"Daily conversation limit reached: {daily_count}")
-            return {
-                'allowed': False,
-                'reason': 'daily_capacity',
-                'message': self.config['messages']['daily_limit'],
-            }
+            return Decision(
+                allowed=False,
+                reason='daily_capacity',
+                message=self.config['messages']['daily_limit'],
+            )
         
         # Check daily cost
-        cost_key = f"global:cost:{today}"
-        daily_cost = float(self.storage.get(cost_key) or 0)
-        daily_budget = limits['max_cost_per_day_usd']
+        daily_cost = float(daily_cost_raw or 0)
+        daily_budget = self._daily_budget
         projected_cost = daily_cost + estimated_cost
         cost_ratio = projected_cost / daily_budget
         
         # Emergency stop (95%)
-        if cost_ratio >= limits['emergency_stop']:
+        if cost_ratio >= self._emergency_stop:
             self._send_alert('critical', 'cost',
                            f"Daily budget exceeded: ${daily_cost:.2f} / ${daily_budget:.2f}")
-            return {
-                'allowed': False,
-                'reason': 'budget_exceeded',
-                'message': self.config['messages']['budget_exceeded'],
-            }
+            return Decision(
+                allowed=False,
+                reason='budget_exceeded',
+                message=self.config['messages']['budget_exceeded'],
+            )
         
         # Throttle (90%)
-        elif cost_ratio >= limits['throttle_threshold']:
+        elif cost_ratio >= self._throttle_threshold:
             self._send_alert('warning', 'cost',
                            f"Daily budget at {cost_ratio*100:.0f}%: ${daily_cost:.2f} / ${daily_budget:.2f}")
-            return {
-                'allowed': True,
-                'throttled': True,
-                'delay': 5,  # Add 5 second delay
-                'message': 'High demand. Response may be slower than usual.',
-            }
+            return Decision(
+                allowed=True,
+                throttled=True,
+                delay=5,  # Add 5 second delay
+                message='High demand. Response may be slower than usual.',
+            )
         
         # Warning (80%)
-        elif cost_ratio >= limits['warning_threshold']:
+        elif cost_ratio >= self._warning_threshold:
             self._send_alert('info', 'cost',
                            f"Daily budget at {cost_ratio*100:.0f}%: ${daily_cost:.2f} / ${daily_budget:.2f}")
         
-        return {'allowed': True}
+        return _ALLOW
     
     def _is_whitelisted(self, ip_address: str, session_id: str) -> bool:
         """Check if IP or session is whitelisted"""
-        whitelist = self.config.get('whitelist', {})
         return (
-            ip_address in whitelist.get('ips', []) or
-            session_id in whitelist.get('sessions', [])
+            ip_address in self._whitelist_ips or
+            session_id in self._whitelist_sessions
         )
     
     def _send_alert(self, level: str, alert_type: str, message: str):
@@ -421,7 +789,7 @@ class RateLimiter:
     
     def get_status(self) -> Dict[str, Any]:
         """Get current rate limiter status"""
-        today = date.today().isoformat()
+        today = _today_iso()
         
         # Global stats
         daily_conversations = int(self.storage.get(f"global:conversations:{today}") or 0)
@@ -448,41 +816,33 @@ class RateLimiter:
 # ============================================
 
 if __name__ == '__main__':
-    """Test rate limiter"""
-    import sys
-    from pathlib import Path
-    
-    # Add project root to path
-    project_root = Path(__file__).parent.parent.parent
-    sys.path.insert(0, str(project_root))
-    
-    # Initialize rate limiter
-    config_path = project_root / 'config' / 'rate_limits.yaml'
-    limiter = RateLimiter(str(config_path))
-    
+    """Test rate limiter
+
+    Run from the project root: python -m src.rate_limiting.rate_limiter
+    """
+    limiter = RateLimiter('config/rate_limits.yaml')
+
     print("=" * 60)
     print("🧪 RATE LIMITER TEST")
     print("=" * 60)
     
     # Test 1: Normal request
     print("\n📋 Test 1: Normal request")
-    result = limiter.check_request("192.168.1.100", "session_123")
+    result = limiter.try_acquire("192.168.1.100", "session_123", 0.051)
     print(f"Result: {result}")
-    
-    if result['allowed']:
-        limiter.record_request("192.168.1.100", "session_123", 0.051)
+
+    if result.allowed:
         print("✅ Request recorded")
     
     # Test 2: Multiple requests (burst)
     print("\n📋 Test 2: Burst requests (testing per-minute limit)")
+    mask = limiter.check_requests("192.168.1.101", "session_456", 12)
     for i in range(12):
-        result = limiter.check_request("192.168.1.101", "session_456")
-        if not result['allowed']:
-            print(f"❌ Request {i+1}: Rate limited - {result['reason']}")
-            break
-        else:
-            limiter.record_request("192.168.1.101", "session_456", 0.051)
+        if mask >> i & 1:
             print(f"✅ Request {i+1}: Allowed")
+        else:
+            print(f"❌ Request {i+1}: Rate limited")
+            break
     
     # Test 3: Status
     print("\n📋 Test 3: Get status")